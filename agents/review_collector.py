@@ -33,8 +33,10 @@ class ReviewCollector:
         try:
             logger.info(f'Starting review collection for {self.app_id}...')
             
-            # Fetch reviews
-            result = [], None
+            cutoff_date = datetime.now() - timedelta(days=30)
+            
+            # Fetch reviews into parallel column lists
+            ids, contents, scores, ats, users = [], [], [], [], []
             continuation_token = None
             collected = 0
             
@@ -47,29 +49,35 @@ class ReviewCollector:
                     count=min(100, self.n_reviews - collected),
                     continuation_token=continuation_token
                 )
-                result[0].extend(batch_result)
+                if not batch_result:
+                    break
+                
+                ids.extend(r.get('reviewId', '') for r in batch_result)
+                contents.extend(r.get('content', '') for r in batch_result)
+                scores.extend(r.get('score', 0) for r in batch_result)
+                ats.extend(r.get('at') for r in batch_result)
+                users.extend(r.get('userName', '') for r in batch_result)
                 collected += len(batch_result)
                 
                 if not continuation_token:
                     break
+                
+                # Reviews come newest first, so once a batch reaches past the cutoff
+                # every later batch would be filtered out anyway
+                if ats[-1] is not None and ats[-1] < cutoff_date:
+                    break
             
-            # Convert to DataFrame
-            reviews_list = result[0][:self.n_reviews]
-            
-            df = pd.DataFrame([
-                {
-                    'reviewId': r.get('reviewId', ''),
-                    'content': r.get('content', ''),
-                    'score': r.get('score', 0),
-                    'at': pd.to_datetime(r.get('at')),
-                    'userName': r.get('userName', '')
-                }
-                for r in reviews_list
-            ])
+            # Convert to DataFrame, parsing all dates in one vectorized call
+            n = self.n_reviews
+            df = pd.DataFrame({
+                'reviewId': ids[:n],
+                'content': contents[:n],
+                'score': scores[:n],
+                'at': pd.to_datetime(ats[:n]),
+                'userName': users[:n]
+            })
             
             # Filter to last 30 days
-            cutoff_date = datetime.now() - timedelta(days=30)
-            df['at'] = pd.to_datetime(df['at'])
             df = df[df['at'] >= cutoff_date].reset_index(drop=True)
             
             logger.info(f'Collected {len(df)} reviews (after filtering last 30 days)')
@@ -1,29 +1,108 @@
+import os
 import pandas as pd
 import numpy as np
 import logging
+import torch
+from functools import cached_property, lru_cache
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 from typing import List, Tuple
 
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=1)
+def _load_sentence_transformer(model_name: str, device: str) -> SentenceTransformer:
+    """
+    Load a sentence transformer model once per process and share it across TopicDeduplicator instances.
+    """
+    logger.info(f'Loading sentence transformer model: {model_name} on {device}')
+    if device == 'cpu':
+        # Encoding scales poorly beyond a handful of threads on CPU
+        torch.set_num_threads(min(8, os.cpu_count() or 1))
+    model = SentenceTransformer(model_name, device=device)
+    if device.startswith('cuda'):
+        # FP16 is noticeably faster on GPU with negligible effect on cosine similarity
+        model = model.half()
+    return model
+
+if njit is not None:
+    @njit(cache=True)
+    def _greedy_assign(quantized: np.ndarray, threshold: float) -> np.ndarray:
+        """
+        Native greedy clustering kernel: returns, for each row, the index of its canonical row.
+        Cosine similarities of the int8 rows are computed on the fly, only against rows that
+        are still unassigned. Dot products use exact integer arithmetic.
+        """
+        n, d = quantized.shape
+        norms = np.empty(n, np.float64)
+        for i in range(n):
+            sq = 0
+            for k in range(d):
+                sq += np.int32(quantized[i, k]) * np.int32(quantized[i, k])
+            norms[i] = np.sqrt(sq)
+        
+        out = np.full(n, -1, np.int64)
+        for i in range(n):
+            if out[i] != -1:
+                continue
+            out[i] = i
+            for j in range(i + 1, n):
+                if out[j] != -1:
+                    continue
+                dot = 0
+                for k in range(d):
+                    dot += np.int32(quantized[i, k]) * np.int32(quantized[j, k])
+                if dot >= threshold * norms[i] * norms[j]:
+                    out[j] = i
+        return out
+else:
+    _greedy_assign = None
+
 class TopicDeduplicator:
     """
     Agent responsible for deduplicating similar topics using embeddings.
     Uses sentence transformers to encode topics and cosine similarity to find duplicates.
     """
     
-    def __init__(self, model_name: str = 'sentence-transformers/all-MiniLM-L6-v2', threshold: float = 0.85):
+    # Below this many topics the Numba kernel's JIT compile costs more than it saves
+    _NUMBA_MIN_TOPICS = 2000
+    
+    def __init__(self, model_name: str = 'sentence-transformers/all-MiniLM-L6-v2', threshold: float = 0.85,
+                 device: str = None, min_topics_for_embedding: int = 8):
         """
         Initialize TopicDeduplicator agent.
         
         Args:
             model_name: Sentence transformer model to use
             threshold: Similarity threshold for considering topics as duplicates (0-1)
+            device: Torch device to run the model on (defaults to CUDA when available, else CPU)
+            min_topics_for_embedding: Below this many distinct topics, only exact matches are merged
+                and the embedding model is never loaded
         """
-        self.model = SentenceTransformer(model_name)
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        
+        self.model_name = model_name
         self.threshold = threshold
-        logger.info(f'TopicDeduplicator initialized with model: {model_name}, threshold: {threshold}')
+        self.device = device
+        self.min_topics_for_embedding = min_topics_for_embedding
+        logger.info(f'TopicDeduplicator initialized with model: {model_name}, threshold: {threshold}, device: {device}')
+    
+    @cached_property
+    def model(self) -> SentenceTransformer:
+        """
+        Sentence transformer model, loaded on first use and reused for the rest of the process.
+        """
+        return _load_sentence_transformer(self.model_name, self.device)
     
     def deduplicate(self, topics_df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -44,14 +123,32 @@ class TopicDeduplicator:
         unique_topics = topics_df['topic'].unique().tolist()
         logger.info(f'Found {len(unique_topics)} unique topics')
         
-        # Encode topics
-        embeddings = self.model.encode(unique_topics, show_progress_bar=False)
+        # Merge topics that differ only in case/whitespace without encoding them
+        representatives = {}
+        for topic in unique_topics:
+            representatives.setdefault(str(topic).strip().lower(), topic)
+        distinct_topics = list(representatives.values())
         
-        # Compute similarity matrix
-        similarity_matrix = cosine_similarity(embeddings)
+        if len(distinct_topics) < self.min_topics_for_embedding:
+            # Too few topics to be worth loading the model
+            distinct_map = {t: t for t in distinct_topics}
+        else:
+            # Encode topics (L2-normalized, so a dot product is the cosine similarity)
+            embeddings = self.model.encode(
+                distinct_topics,
+                batch_size=64,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            
+            # Greedy clustering
+            distinct_map = self._greedy_cluster(distinct_topics, embeddings)
         
-        # Greedy clustering
-        canonical_map = self._greedy_cluster(unique_topics, similarity_matrix)
+        canonical_map = {
+            topic: distinct_map[representatives[str(topic).strip().lower()]]
+            for topic in unique_topics
+        }
         
         # Map topics to canonical topics
         topics_df['canonical_topic'] = topics_df['topic'].map(canonical_map)
@@ -61,38 +158,68 @@ class TopicDeduplicator:
         
         return topics_df
     
-    def _greedy_cluster(self, topics: List[str], similarity_matrix: np.ndarray) -> dict:
+    def _similarities(self, vectors: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        Compute cosine similarity of each vector to a single query vector.
+        Uses SimSIMD on int8 vectors when installed, otherwise a NumPy matrix-vector
+        product on L2-normalized FP32 vectors.
+        """
+        if simsimd is not None:
+            return 1 - np.asarray(simsimd.cdist(vectors, query[np.newaxis, :], metric='cosine')).ravel()
+        return vectors @ query
+    
+    @staticmethod
+    def _quantize(embeddings: np.ndarray) -> np.ndarray:
         """
-        Greedy clustering: assign each topic to closest canonical topic or create new one.
+        Quantize L2-normalized embeddings to int8 (4x smaller, same thresholding decisions
+        in practice since every component lies in [-1, 1]).
+        """
+        return np.clip(np.round(embeddings * 127), -127, 127).astype(np.int8)
+    
+    def _greedy_cluster(self, topics: List[str], embeddings: np.ndarray) -> dict:
+        """
+        Greedy clustering: assign each topic to the first canonical topic it is similar to,
+        or make it a new canonical topic.
+        
+        Each pass takes the first unassigned topic as a new canonical topic and assigns it
+        every unassigned topic above the threshold in one vectorized step. Similarities are
+        only computed between the new canonical topic and the remaining unassigned topics,
+        so the full N x N similarity matrix is never built.
+        
+        Embeddings are always quantized to int8 first, and every backend (Numba kernel for
+        large topic sets, SimSIMD, NumPy) thresholds the cosine similarity of those quantized
+        vectors. Assignments therefore do not depend on which optional packages are
+        installed, apart from floating-point rounding of similarities exactly at the threshold.
         
         Args:
             topics: List of topic strings
-            similarity_matrix: Similarity matrix between topics
+            embeddings: L2-normalized embeddings, one row per topic
             
         Returns:
             Dictionary mapping topic -> canonical_topic
         """
+        quantized = self._quantize(np.ascontiguousarray(embeddings, dtype=np.float32))
+        
+        if _greedy_assign is not None and len(topics) > self._NUMBA_MIN_TOPICS:
+            canonical_idx = _greedy_assign(quantized, self.threshold)
+            return {topics[i]: topics[canonical_idx[i]] for i in range(len(topics))}
+        
+        if simsimd is not None:
+            vectors = quantized
+        else:
+            # Re-normalize the quantized vectors so a dot product is their cosine similarity
+            vectors = quantized.astype(np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        
         canonical_map = {}
-        canonical_topics = []
-        canonical_indices = []
+        unassigned = np.arange(len(topics))
         
-        for i, topic in enumerate(topics):
-            if topic in canonical_map:
-                continue
-            
-            # Check similarity with existing canonical topics
-            found_canonical = False
-            for c_idx in canonical_indices:
-                sim = similarity_matrix[i, c_idx]
-                if sim >= self.threshold:
-                    canonical_map[topic] = canonical_topics[canonical_indices.index(c_idx)]
-                    found_canonical = True
-                    break
-            
-            # If no similar canonical topic, create new one
-            if not found_canonical:
-                canonical_map[topic] = topic
-                canonical_topics.append(topic)
-                canonical_indices.append(i)
+        while unassigned.size > 0:
+            i = unassigned[0]
+            members = self._similarities(vectors[unassigned], vectors[i]) >= self.threshold
+            members[0] = True
+            for j in unassigned[members]:
+                canonical_map[topics[j]] = topics[i]
+            unassigned = unassigned[~members]
         
         return canonical_map
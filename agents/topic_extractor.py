@@ -1,110 +1,356 @@
 import pandas as pd
 import logging
 import json
-from typing import List, Dict
+import time
+import asyncio
+import hashlib
+from typing import List, Dict, Optional, Tuple
+import httpx
 import openai
+from openai import AsyncOpenAI
+import diskcache
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
 logger = logging.getLogger(__name__)
 
+# Errors worth retrying: rate limits (429) and transient server/network failures (5xx)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError
+)
+
+# Fields every LLM answer must provide, as strings
+ANSWER_FIELDS = ('category', 'topic', 'sentiment')
+
+class _ExtractionRun:
+    """
+    State of a single extract_async call: its OpenAI client and token budget window.
+    Kept off the TopicExtractor instance so concurrent runs on one extractor don't share
+    (or close) each other's client.
+    """
+    
+    def __init__(self, client: AsyncOpenAI, tokens_per_minute: int):
+        self.client = client
+        self.tokens_per_minute = tokens_per_minute
+        self.budget_lock = asyncio.Lock()
+        self.window_start = time.monotonic()
+        self.window_tokens = 0
+    
+    async def reserve_tokens(self, n_tokens: int):
+        """
+        Block until n_tokens fit in the current one-minute window.
+        """
+        async with self.budget_lock:
+            elapsed = time.monotonic() - self.window_start
+            if elapsed >= 60:
+                self.window_start = time.monotonic()
+                self.window_tokens = 0
+            elif self.window_tokens + n_tokens > self.tokens_per_minute:
+                logger.info(f'Token budget reached, sleeping {60 - elapsed:.1f}s')
+                await asyncio.sleep(60 - elapsed)
+                self.window_start = time.monotonic()
+                self.window_tokens = 0
+            self.window_tokens += n_tokens
+
 class TopicExtractor:
     """
     Agent responsible for extracting structured topics from reviews using LLM.
     Uses OpenAI's API to identify issues, feature requests, and feedback.
     """
     
-    def __init__(self, api_key: str, model: str = 'gpt-3.5-turbo'):
+    # Static instructions are built once and sent as the system message, keeping them apart
+    # from the untrusted review text in the user message. The prefix is well below the
+    # 1024-token minimum for OpenAI prompt caching, so it brings no caching discount.
+    _SYSTEM_PROMPT = """You analyze Google Play Store app reviews and extract the main topic of each review.
+
+You will receive a numbered list of reviews. Respond with a JSON object with a single field "topics":
+an array containing exactly one object per review, in the same order as the reviews.
+Each object must have these fields:
+- index: the number of the review it answers (e.g. 1 for "Review 1")
+- category: one of ['issue', 'feature_request', 'feedback', 'other']
+- topic: brief description of the topic
+- sentiment: one of ['positive', 'negative', 'neutral']
+"""
+    _PROMPT_PREFIX = "Reviews:\n"
+    _PROMPT_SUFFIX = "\n\nJSON Response:\n"
+    
+    def __init__(self, api_key: str, model: str = 'gpt-4o-mini', batch_size: int = 25,
+                 max_concurrent: int = 10, tokens_per_minute: int = 90000,
+                 cache_dir: Optional[str] = 'data/cache/topics'):
         """
         Initialize TopicExtractor agent.
         
         Args:
             api_key: OpenAI API key
             model: Model to use for extraction
+            batch_size: Number of reviews packed into a single LLM request
+            max_concurrent: Maximum number of LLM requests in flight at once
+            tokens_per_minute: Token budget per minute shared by all requests
+            cache_dir: Directory of the on-disk LLM response cache (None disables it)
         """
-        openai.api_key = api_key
+        self.api_key = api_key
         self.model = model
-        logger.info(f'TopicExtractor initialized with model: {model}')
+        self.batch_size = batch_size
+        self.max_concurrent = max_concurrent
+        self.tokens_per_minute = tokens_per_minute
+        self.cache = diskcache.Cache(cache_dir) if cache_dir else None
+        # Answers depend on the prompt too, so editing it must not reuse old cached answers
+        self._prompt_hash = hashlib.blake2b(
+            (self._SYSTEM_PROMPT + self._PROMPT_PREFIX + self._PROMPT_SUFFIX).encode(),
+            digest_size=8
+        ).hexdigest()
+        self._memory_cache = {}
+        logger.info(f'TopicExtractor initialized with model: {model}, batch_size: {batch_size}, '
+                    f'max_concurrent: {max_concurrent}')
     
     def extract(self, reviews_df: pd.DataFrame) -> pd.DataFrame:
         """
         Extract topics from review texts using LLM.
+        Synchronous wrapper around extract_async; from code already running inside an
+        event loop (Jupyter, async web handlers), await extract_async instead.
         
         Args:
             reviews_df: DataFrame with review data
             
         Returns:
-            DataFrame with extracted topics
+            DataFrame with extracted topics (see extract_async)
         """
-        topics = []
-        
-        for idx, row in reviews_df.iterrows():
-            try:
-                topic_record = self._extract_from_review(
-                    review_id=row['reviewId'],
-                    review_text=row['content'],
-                    date=row['at']
-                )
-                if topic_record:
-                    topics.append(topic_record)
-            except Exception as e:
-                logger.warning(f'Error extracting topic from review {row["reviewId"]}: {e}')
-        
-        df = pd.DataFrame(topics)
-        logger.info(f'Extracted {len(df)} topics from {len(reviews_df)} reviews')
-        return df
+        return asyncio.run(self.extract_async(reviews_df))
     
-    def _extract_from_review(self, review_id: str, review_text: str, date) -> Dict:
+    async def extract_async(self, reviews_df: pd.DataFrame) -> pd.DataFrame:
         """
-        Extract topic from a single review.
+        Extract topics from review texts using LLM, issuing batches concurrently.
+        
+        Args:
+            reviews_df: DataFrame with review data
+            
+        Returns:
+            DataFrame with extracted topics; the 'extracted' column is False for reviews
+            that got the default record because the LLM gave no usable answer
         """
-        if not review_text or len(review_text.strip()) == 0:
-            return None
+        # Skip empty reviews up front so they don't take a slot in a batch
+        reviews = [
+            (review_id, review_text, date)
+            for review_id, review_text, date in reviews_df[['reviewId', 'content', 'at']].itertuples(index=False, name=None)
+            if isinstance(review_text, str) and len(review_text.strip()) > 0
+        ]
         
-        prompt = f"""
-Analyze this app review and extract the main topic.
-Respond with a JSON object with these fields:
-- category: one of ['issue', 'feature_request', 'feedback', 'other']
-- topic: brief description of the topic
-- sentiment: one of ['positive', 'negative', 'neutral']
-
-Review: {review_text}
-
-JSON Response:
-"""
+        # Resolve cached answers; identical texts are only sent to the LLM once
+        keys = [self._cache_key(review_text) for _, review_text, _ in reviews]
+        results = {}
+        pending = {}
+        for key, (_, review_text, _) in zip(keys, reviews):
+            if key in results or key in pending:
+                continue
+            cached = self._cache_get(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                pending[key] = review_text
+        logger.info(f'{len(results)} cache hits, {len(pending)} unique reviews to send to LLM')
         
-        try:
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-                max_tokens=100
-            )
-            
-            response_text = response['choices'][0]['message']['content'].strip()
-            # Parse JSON response
-            try:
-                data = json.loads(response_text)
-            except json.JSONDecodeError:
-                # Fallback parsing
+        pending_items = list(pending.items())
+        batches = [pending_items[start:start + self.batch_size]
+                   for start in range(0, len(pending_items), self.batch_size)]
+        
+        for batch, batch_data in zip(batches, await self._extract_all_async(batches)):
+            for (key, _), data in zip(batch, batch_data):
+                if data is not None:
+                    results[key] = data
+                    self._cache_set(key, data)
+        
+        topics = []
+        for key, (review_id, review_text, date) in zip(keys, reviews):
+            data = results.get(key)
+            # Fallback records are marked so later runs retry them instead of reusing them
+            extracted = data is not None
+            if not extracted:
                 data = {
                     'category': 'feedback',
                     'topic': review_text[:50],
                     'sentiment': 'neutral'
                 }
-            
-            return {
+            topics.append({
                 'review_id': review_id,
                 'date': date,
                 'category': data.get('category', 'other'),
                 'topic': data.get('topic', review_text[:50]),
-                'sentiment': data.get('sentiment', 'neutral')
-            }
+                'sentiment': data.get('sentiment', 'neutral'),
+                'extracted': extracted
+            })
+        
+        df = pd.DataFrame(topics)
+        logger.info(f'Extracted {len(df)} topics from {len(reviews_df)} reviews')
+        return df
+    
+    def _cache_key(self, review_text: str) -> str:
+        """
+        Cache key for a review: hash of the model name, the prompt and the normalized review text.
+        """
+        return hashlib.blake2b(
+            (self.model + '|' + self._prompt_hash + '|' + review_text.strip().lower()).encode(),
+            digest_size=16
+        ).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[Dict]:
+        """
+        Look up a cached LLM answer, in-process first, then on disk.
+        """
+        if key in self._memory_cache:
+            return self._memory_cache[key]
+        if self.cache is not None:
+            data = self.cache.get(key)
+            if data is not None:
+                self._memory_cache[key] = data
+            return data
+        return None
+    
+    def _cache_set(self, key: str, data: Dict):
+        """
+        Store an LLM answer in the in-process and on-disk caches.
+        """
+        self._memory_cache[key] = data
+        if self.cache is not None:
+            self.cache.set(key, data)
+    
+    async def _extract_all_async(self, batches: List[List[Tuple[str, str]]]) -> List[List[Optional[Dict]]]:
+        """
+        Run all batches concurrently, bounded by max_concurrent and the token budget.
+        
+        Returns:
+            List of per-batch LLM answers, in submission order
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        # One client (and keep-alive connection pool) shared by every request in this run;
+        # it is created inside the event loop because httpx async pools are bound to it
+        client = AsyncOpenAI(
+            api_key=self.api_key,
+            max_retries=0,  # retries are handled by tenacity
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            )
+        )
+        extraction_run = _ExtractionRun(client, self.tokens_per_minute)
+        
+        async def run(batch_idx: int, batch: List[Tuple[str, str]]) -> Tuple[int, List[Optional[Dict]]]:
+            async with semaphore:
+                try:
+                    return batch_idx, await self._extract_batch_async(extraction_run, batch)
+                except Exception as e:
+                    logger.warning(f'Error extracting topics from batch {batch_idx}: {e}')
+                    return batch_idx, [None] * len(batch)
+        
+        try:
+            results = await asyncio.gather(*(run(i, batch) for i, batch in enumerate(batches)))
+        finally:
+            await client.close()
+        return [records for _, records in sorted(results, key=lambda r: r[0])]
+    
+    @retry(
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(6),
+        reraise=True
+    )
+    async def _create_completion_async(self, extraction_run: _ExtractionRun, prompt: str, max_tokens: int,
+                                       temperature: float = 0.3):
+        """
+        Issue a single JSON-mode chat completion request, retrying on rate limits and server errors.
+        """
+        # Rough estimate: ~4 characters per token for the prompt, plus the completion budget
+        await extraction_run.reserve_tokens((len(self._SYSTEM_PROMPT) + len(prompt)) // 4 + max_tokens)
+        return await extraction_run.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self._SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"}
+        )
+    
+    async def _extract_batch_async(self, extraction_run: _ExtractionRun,
+                                   reviews: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        """
+        Extract topics from a batch of reviews with a single LLM request.
+        
+        Args:
+            extraction_run: Client and token budget of the current extract_async call
+            reviews: List of (cache_key, review_text) tuples
+            
+        Returns:
+            List of LLM answers (category/topic/sentiment dicts), one per review in input order;
+            None where the response had no usable answer for that review
+        """
+        numbered_reviews = '\n'.join(
+            f'Review {i}: {text}' for i, (_, text) in enumerate(reviews, start=1)
+        )
+        
+        prompt = self._PROMPT_PREFIX + numbered_reviews + self._PROMPT_SUFFIX
+        
+        max_tokens = 60 * len(reviews)
+        temperature = 0.3
+        items = []
+        try:
+            for _ in range(2):
+                response = await self._create_completion_async(
+                    extraction_run, prompt, max_tokens=max_tokens, temperature=temperature
+                )
+                choice = response.choices[0]
+                
+                if choice.finish_reason == 'length':
+                    # Resending the same request would be cut off again
+                    if len(reviews) > 1:
+                        logger.warning(f'Response cut off at max_tokens={max_tokens}, '
+                                       f'splitting batch of {len(reviews)} reviews')
+                        mid = len(reviews) // 2
+                        return (await self._extract_batch_async(extraction_run, reviews[:mid])
+                                + await self._extract_batch_async(extraction_run, reviews[mid:]))
+                    logger.warning(f'Response cut off at max_tokens={max_tokens}, retrying with more room')
+                    max_tokens *= 4
+                    continue
+                
+                # JSON mode output that was not cut off should parse; retry once
+                # deterministically if it does not
+                try:
+                    data = json.loads((choice.message.content or '').strip())
+                    items = data.get('topics', []) if isinstance(data, dict) else data
+                    break
+                except json.JSONDecodeError as e:
+                    logger.warning(f'Malformed JSON response (temperature={temperature}): {e}')
+                    temperature = 0.0
+            
+            if not isinstance(items, list):
+                logger.warning(f'Unexpected JSON response shape: {type(items).__name__}')
+                items = []
         
         except Exception as e:
             logger.error(f'OpenAI API error: {e}')
-            return {
-                'review_id': review_id,
-                'date': date,
-                'category': 'feedback',
-                'topic': review_text[:50],
-                'sentiment': 'neutral'
-            }
+            items = []
+        
+        # Match answers to reviews by their "index" field, never by array position, so a
+        # dropped or merged item cannot shift answers onto the wrong reviews
+        answers = [None] * len(reviews)
+        duplicates = set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            idx = item.get('index')
+            if isinstance(idx, bool) or not isinstance(idx, int) or not 1 <= idx <= len(reviews):
+                continue
+            if not all(isinstance(item.get(field), str) for field in ANSWER_FIELDS):
+                continue
+            if answers[idx - 1] is not None:
+                duplicates.add(idx - 1)
+            answers[idx - 1] = {field: item[field] for field in ANSWER_FIELDS}
+        
+        # An index answered twice is ambiguous, so trust neither answer
+        for i in duplicates:
+            answers[i] = None
+        
+        n_missing = sum(answer is None for answer in answers)
+        if n_missing:
+            logger.warning(f'{n_missing} of {len(reviews)} reviews in batch had no usable answer')
+        return answers
@@ -1,5 +1,7 @@
 import pandas as pd
+import numpy as np
 import logging
+from pandas.api.types import is_datetime64_any_dtype
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -35,29 +37,31 @@ class TrendBuilder:
             return pd.DataFrame()
         
         # Ensure date column is datetime
-        topics_df['date'] = pd.to_datetime(topics_df['date'])
+        if not is_datetime64_any_dtype(topics_df['date']):
+            topics_df['date'] = pd.to_datetime(topics_df['date'])
         
         # Filter to last N days
         cutoff_date = datetime.now() - timedelta(days=self.days)
-        filtered_df = topics_df[topics_df['date'] >= cutoff_date].copy()
+        mask = topics_df['date'] >= cutoff_date
+        filtered_df = topics_df.loc[mask, ['canonical_topic', 'date']]
         
-        # Extract date (without time)
-        filtered_df['date_only'] = filtered_df['date'].dt.date
+        # Truncate to day, keeping a datetime64 dtype instead of Python date objects
+        filtered_df['day'] = filtered_df['date'].values.astype('datetime64[D]')
         
-        # Aggregate: count topics per canonical_topic per date
-        trend_data = filtered_df.groupby(['canonical_topic', 'date_only']).size().reset_index(name='count')
+        # Categorical keys let crosstab count codes instead of hashing strings and timestamps
+        filtered_df['canonical_topic'] = filtered_df['canonical_topic'].astype('category')
+        filtered_df['day'] = filtered_df['day'].astype('category')
         
-        # Pivot: topics as rows, dates as columns
-        trend_pivot = trend_data.pivot_table(
-            index='canonical_topic',
-            columns='date_only',
-            values='count',
-            aggfunc='sum',
-            fill_value=0
-        )
+        # Count topics per canonical_topic per day: topics as rows, days as columns
+        trend_pivot = pd.crosstab(filtered_df['canonical_topic'], filtered_df['day'])
         
-        # Convert to integers
-        trend_pivot = trend_pivot.astype(int)
+        # Daily counts per topic fit in int16 unless the review volume is very large
+        max_count = trend_pivot.to_numpy().max(initial=0)
+        trend_pivot = trend_pivot.astype(np.int16 if max_count <= np.iinfo(np.int16).max else np.int32)
+        trend_pivot.columns = pd.DatetimeIndex(trend_pivot.columns).date
+        trend_pivot.columns.name = 'date_only'
+        # Output plain topic labels rather than a categorical column
+        trend_pivot.index = trend_pivot.index.astype(object)
         
         # Reset index to make canonical_topic a column
         trend_pivot.reset_index(inplace=True)
@@ -7,6 +7,7 @@ This script coordinates all agents to collect, analyze, and deduplicate reviews.
 import os
 import sys
 import logging
+import pandas as pd
 from dotenv import load_dotenv
 from agents.review_collector import ReviewCollector
 from agents.topic_extractor import TopicExtractor
@@ -23,6 +24,21 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+def load_existing_topics(topics_path: str) -> pd.DataFrame:
+    """
+    Load topics the LLM successfully extracted in a previous run, or an empty DataFrame if there are none.
+    """
+    if not os.path.exists(topics_path):
+        return pd.DataFrame()
+    existing_df = pd.read_parquet(topics_path, engine='pyarrow')
+    if 'extracted' not in existing_df.columns:
+        # Written before fallback records were flagged, so nothing in it can be trusted
+        return pd.DataFrame()
+    # Fallback records from failed LLM calls are dropped so those reviews are retried
+    existing_df = existing_df[existing_df['extracted']]
+    logger.info(f'Loaded {len(existing_df)} previously extracted topics from {topics_path}')
+    return existing_df
+
 def main():
     """
     Execute the complete pipeline:
@@ -53,16 +69,29 @@ def main():
     logger.info('Step 1: Collecting reviews...')
     collector = ReviewCollector(app_id=app_id, n_reviews=500)
     reviews_df = collector.collect()
-    reviews_path = f'data/raw/reviews_{app_id}.csv'
-    reviews_df.to_csv(reviews_path, index=False)
+    reviews_path = f'data/raw/reviews_{app_id}.parquet'
+    reviews_df.to_parquet(reviews_path, engine='pyarrow', compression='zstd', index=False)
     logger.info(f'Collected {len(reviews_df)} reviews -> {reviews_path}')
     
+    # Downstream stages only need the review id, text and date
+    reviews_df = reviews_df[['reviewId', 'content', 'at']]
+    
     # Step 2: Extract Topics
     logger.info('Step 2: Extracting topics from reviews...')
-    extractor = TopicExtractor(api_key=openai_api_key, model='gpt-3.5-turbo')
-    topics_df = extractor.extract(reviews_df)
-    topics_path = f'data/processed/topics_{app_id}.csv'
-    topics_df.to_csv(topics_path, index=False)
+    extractor = TopicExtractor(api_key=openai_api_key, model='gpt-4o-mini')
+    topics_path = f'data/processed/topics_{app_id}.parquet'
+    
+    # Reuse topics for reviews already processed by a previous run
+    existing_topics_df = load_existing_topics(topics_path)
+    if len(existing_topics_df) > 0:
+        existing_topics_df = existing_topics_df[existing_topics_df['review_id'].isin(reviews_df['reviewId'])]
+        new_reviews_df = reviews_df[~reviews_df['reviewId'].isin(existing_topics_df['review_id'])]
+    else:
+        new_reviews_df = reviews_df
+    logger.info(f'{len(reviews_df) - len(new_reviews_df)} reviews already processed, extracting {len(new_reviews_df)}')
+    
+    topics_df = pd.concat([existing_topics_df, extractor.extract(new_reviews_df)], ignore_index=True)
+    topics_df.to_parquet(topics_path, engine='pyarrow', compression='zstd', index=False)
     logger.info(f'Extracted {len(topics_df)} topics -> {topics_path}')
     
     # Step 3: Deduplicate Topics
@@ -72,8 +101,8 @@ def main():
         threshold=0.85
     )
     dedup_df = deduplicator.deduplicate(topics_df)
-    dedup_path = f'data/processed/topics_dedup_{app_id}.csv'
-    dedup_df.to_csv(dedup_path, index=False)
+    dedup_path = f'data/processed/topics_dedup_{app_id}.parquet'
+    dedup_df.to_parquet(dedup_path, engine='pyarrow', compression='zstd', index=False)
     logger.info(f'Deduplicated to {len(dedup_df["canonical_topic"].unique())} unique topics -> {dedup_path}')
     
     # Step 4: Build Trend Table